@@ -4,6 +4,12 @@
 #include <string>
 #include <sstream>
 #include <iomanip>
+#include <cstdlib>
+#include <cstring>
+#ifdef _WIN32
+#include <io.h>
+#include <fcntl.h>
+#endif
 
 using json = nlohmann::json;
 
@@ -11,58 +17,93 @@ Simulator::Simulator()
 {
     PC = 0;
     memory.resize(MEM_SIZE, 0);
+    emitted_mem.resize(MEM_SIZE / 8, 0);
     reg.fill(0);
     stat = Stat::AOK;
 }
 
-uint8_t hexToByte(const std::string &hex)
+// 十六进制字符的数值, 非法字符返回 -1
+static inline int hexDigit(char c)
 {
-    unsigned int val;
-    std::stringstream ss;
-    ss << std::hex << hex;
-    ss >> val;
-    return static_cast<uint8_t>(val);
+    if (c >= '0' && c <= '9')
+        return c - '0';
+    c |= 0x20;
+    if (c >= 'a' && c <= 'f')
+        return c - 'a' + 10;
+    return -1;
 }
 
-void Simulator::loadProgram()
+// 两个十六进制字符组成的字节; 与流式解析一致, 只取开头的合法数字
+static inline uint8_t hexPairToByte(char hi, char lo)
+{
+    int h = hexDigit(hi), l = hexDigit(lo);
+    if (h < 0)
+        return 0;
+    return static_cast<uint8_t>(l < 0 ? h : h << 4 | l);
+}
+
+// 读取小端 8 字节整数: 一次 memcpy 即单条加载指令, 取代逐字节移位拼接
+static inline long long loadLE64(const uint8_t *p)
+{
+    uint64_t val;
+    std::memcpy(&val, p, 8);
+#if defined(__BYTE_ORDER__) && __BYTE_ORDER__ == __ORDER_BIG_ENDIAN__
+    val = __builtin_bswap64(val);
+#endif
+    return static_cast<long long>(val);
+}
+
+// 写入小端 8 字节整数, 与 loadLE64 对应
+static inline void storeLE64(uint8_t *p, long long val)
+{
+    uint64_t v = static_cast<uint64_t>(val);
+#if defined(__BYTE_ORDER__) && __BYTE_ORDER__ == __ORDER_BIG_ENDIAN__
+    v = __builtin_bswap64(v);
+#endif
+    std::memcpy(p, &v, 8);
+}
+
+void Simulator::loadProgram(std::istream &in)
 {
     std::string line;
-    while (std::getline(std::cin, line))
+    while (std::getline(in, line))
     {
+        // '|' 之后是汇编源码注释, 先截掉, 地址和冒号只在前半段查找
+        size_t pipePos = line.find('|');
+        if (pipePos != std::string::npos)
+            line.resize(pipePos);
         size_t addrPos = line.find("0x");
-        size_t colonPos = line.find(":");
-        size_t pipePos = line.find("|");
+        size_t colonPos = line.find(':');
 
         if (addrPos != std::string::npos && colonPos != std::string::npos)
         {
-            std::string addrStr = line.substr(addrPos, colonPos - addrPos);
-            long long addr = 0;
-            std::stringstream ss;
-            ss << std::hex << addrStr;
-            ss >> addr;
-
-            size_t dataEnd = (pipePos == std::string::npos) ? line.length() : pipePos;
-            std::string dataStr = line.substr(colonPos + 1, dataEnd - (colonPos + 1));
-
-            std::string cleanData;
-            for (char c : dataStr)
+            // strtoll 以 16 为基数时自行跳过 "0x" 前缀, 遇到 ':' 即停止
+            long long addr = std::strtoll(line.c_str() + addrPos, nullptr, 16);
+            long long lineStart = addr;
+
+            // 跳过空白, 每两个十六进制字符直接解码为一个字节写入内存
+            char hi = 0;
+            bool havePending = false;
+            for (size_t i = colonPos + 1; i < line.size(); ++i)
             {
-                if (!isspace(c))
-                    cleanData += c;
-            }
-
-            for (size_t i = 0; i < cleanData.length(); i += 2)
-            {
-                if (i + 1 < cleanData.length())
+                char c = line[i];
+                if (isspace(static_cast<unsigned char>(c)))
+                    continue;
+                if (!havePending)
+                {
+                    hi = c;
+                    havePending = true;
+                    continue;
+                }
+                havePending = false;
+                if (addr < MEM_SIZE)
                 {
-                    std::string byteStr = cleanData.substr(i, 2);
-                    if (addr < MEM_SIZE)
-                    {
-                        memory[addr] = hexToByte(byteStr);
-                        addr++;
-                    }
+                    memory[addr] = hexPairToByte(hi, c);
+                    addr++;
                 }
             }
+            if (addr > lineStart)
+                markWritten(lineStart, addr - lineStart);
         }
     }
 }
@@ -88,56 +129,60 @@ void Simulator::loadBlockToCache(int set_index, unsigned long long tag)
     line.valid = true;
 }
 
-uint8_t Simulator::readByteCached(long long addr)
+// 查找 addr 所在的 Cache 块并计一次命中/未命中, 未命中时从主存载入该块
+CacheLine &Simulator::accessBlock(long long addr)
 {
     unsigned long long set_index = (addr >> BLOCK_BITS) & (CACHE_SETS - 1);
     unsigned long long tag = addr >> (BLOCK_BITS + 4);
-    unsigned long long offset = addr & (BLOCK_SIZE - 1);
 
     CacheLine &line = cache[set_index];
 
     if (line.valid && line.tag == tag)
     {
         cache_hits++;
-        return line.block[offset];
     }
     else
     {
         cache_misses++;
         loadBlockToCache(set_index, tag);
-        return line.block[offset];
     }
+    return line;
+}
+
+uint8_t Simulator::readByteCached(long long addr)
+{
+    return accessBlock(addr).block[addr & (BLOCK_SIZE - 1)];
 }
 
 void Simulator::writeByteCached(long long addr, uint8_t val)
 {
+    // 直写: 先写主存, 未命中时按写分配载入的块已包含新值
     memory[addr] = val;
+    accessBlock(addr).block[addr & (BLOCK_SIZE - 1)] = val;
+}
 
-    unsigned long long set_index = (addr >> BLOCK_BITS) & (CACHE_SETS - 1);
-    unsigned long long tag = addr >> (BLOCK_BITS + 4);
-    unsigned long long offset = addr & (BLOCK_SIZE - 1);
-
-    CacheLine &line = cache[set_index];
-
-    if (line.valid && line.tag == tag)
-    {
-        cache_hits++;
-        line.block[offset] = val;
-    }
-    else
-    {
-        cache_misses++;
-        loadBlockToCache(set_index, tag);
-    }
+// [addr, addr + len) 是否完全落在内存内: 负地址转为无符号后极大, 一次比较即可同时排除
+static inline bool inBounds(long long addr, int len)
+{
+    return static_cast<unsigned long long>(addr) <= static_cast<unsigned long long>(MEM_SIZE - len);
 }
 
 long long Simulator::readLong(long long addr)
 {
-    if (addr < 0 || addr + 8 > MEM_SIZE)
+    if (!inBounds(addr, 8))
     {
         stat = Stat::ADR;
         return 0;
     }
+    // 8 字节落在同一 Cache 块内 (对齐访问总是如此) 时只查一次块并整体拷贝;
+    // 逐字节访问时首字节决定命中与否, 其余 7 字节必然命中, 统计保持一致
+    int offset = addr & (BLOCK_SIZE - 1);
+    if (offset <= BLOCK_SIZE - 8)
+    {
+        long long val = loadLE64(&accessBlock(addr).block[offset]);
+        cache_hits += 7;
+        return val;
+    }
     long long val = 0;
     for (int i = 0; i < 8; ++i)
     {
@@ -147,13 +192,33 @@ long long Simulator::readLong(long long addr)
     return val;
 }
 
+void Simulator::markWritten(long long addr, long long len)
+{
+    int lo = static_cast<int>(addr) & ~7;
+    int hi = static_cast<int>((addr + len + 7) & ~7LL);
+    if (lo < mem_lo)
+        mem_lo = lo;
+    if (hi > mem_hi)
+        mem_hi = hi;
+}
+
 void Simulator::writeLong(long long addr, long long val)
 {
-    if (addr < 0 || addr + 8 > MEM_SIZE)
+    if (!inBounds(addr, 8))
     {
         stat = Stat::ADR;
         return;
     }
+    markWritten(addr, 8);
+    mem_dirty = true;
+    int offset = addr & (BLOCK_SIZE - 1);
+    if (offset <= BLOCK_SIZE - 8)
+    {
+        storeLE64(&memory[addr], val);
+        storeLE64(&accessBlock(addr).block[offset], val);
+        cache_hits += 7;
+        return;
+    }
     for (int i = 0; i < 8; ++i)
     {
         uint8_t byte = (val >> (i * 8)) & 0xFF;
@@ -161,9 +226,16 @@ void Simulator::writeLong(long long addr, long long val)
     }
 }
 
+// 按 icode 索引的位掩码: 指令是否带寄存器字节 / 是否带 8 字节常数
+static const unsigned NEED_REGS = 1 << ICode::RRMOVQ | 1 << ICode::IRMOVQ | 1 << ICode::RMMOVQ |
+                                  1 << ICode::MRMOVQ | 1 << ICode::OPQ | 1 << ICode::PUSHQ |
+                                  1 << ICode::POPQ;
+static const unsigned NEED_VALC = 1 << ICode::IRMOVQ | 1 << ICode::RMMOVQ | 1 << ICode::MRMOVQ |
+                                  1 << ICode::JXX | 1 << ICode::CALL;
+
 void Simulator::fetch()
 {
-    if (PC < 0 || PC >= MEM_SIZE)
+    if (!inBounds(PC, 1))
     {
         stat = Stat::ADR;
         return;
@@ -176,13 +248,16 @@ void Simulator::fetch()
         stat = Stat::INS;
         return;
     }
+    // 整条指令都须在内存内, 否则下面读取操作数会越界
+    int length = 1 + (NEED_REGS >> icode & 1) + 8 * (NEED_VALC >> icode & 1);
+    if (!inBounds(PC, length))
+    {
+        stat = Stat::ADR;
+        return;
+    }
 
     valP = PC + 1;
-    bool need_regs = (icode == ICode::RRMOVQ || icode == ICode::OPQ ||
-                      icode == ICode::PUSHQ || icode == ICode::POPQ ||
-                      icode == ICode::IRMOVQ || icode == ICode::RMMOVQ ||
-                      icode == ICode::MRMOVQ);
-    if (need_regs)
+    if (NEED_REGS >> icode & 1)
     {
         uint8_t byte1 = memory[valP];
         rA = (byte1 >> 4) & 0xF;
@@ -195,15 +270,9 @@ void Simulator::fetch()
         rB = Reg::NONE;
     }
 
-    bool need_valC = (icode == ICode::IRMOVQ || icode == ICode::RMMOVQ ||
-                      icode == ICode::MRMOVQ || icode == ICode::JXX ||
-                      icode == ICode::CALL);
-    if (need_valC)
+    if (NEED_VALC >> icode & 1)
     {
-        long long val = 0;
-        for (int i = 0; i < 8; ++i)
-            val |= (long long)memory[valP + i] << (i * 8);
-        valC = val;
+        valC = loadLE64(&memory[valP]);
         valP += 8;
     }
 }
@@ -215,80 +284,85 @@ void Simulator::decode()
         srcA = rA;
     else if (icode == ICode::POPQ || icode == ICode::RET)
         srcA = Reg::RSP;
-    valA = (srcA == Reg::NONE) ? 0 : reg[srcA];
+    valA = reg[srcA];
 
     int srcB = Reg::NONE;
     if (icode == ICode::OPQ || icode == ICode::RMMOVQ || icode == ICode::MRMOVQ)
         srcB = rB;
     else if (icode == ICode::PUSHQ || icode == ICode::POPQ || icode == ICode::CALL || icode == ICode::RET)
         srcB = Reg::RSP;
-    valB = (srcB == Reg::NONE) ? 0 : reg[srcB];
+    valB = reg[srcB];
+}
+
+// 64 位回绕加法: 经无符号运算实现, 避免有符号溢出的未定义行为
+static inline long long wrapAdd(long long a, long long b)
+{
+    return static_cast<long long>(static_cast<unsigned long long>(a) + static_cast<unsigned long long>(b));
 }
 
+// 条件码真值表: 第 ifun 项的第 (ZF<<2 | SF<<1 | OF) 位即该条件是否成立
+// 依次为 无条件、le、l、e、ne、ge、g
+static const uint8_t COND_TABLE[7] = {0xFF, 0xF6, 0x66, 0xF0, 0x0F, 0x99, 0x09};
+
 void Simulator::execute()
 {
-    if (icode == ICode::OPQ)
+    switch (icode)
     {
-        long long a = valA, b = valB;
-        if (ifun == 0)
-            valE = b + a;
-        else if (ifun == 1)
-            valE = b - a;
-        else if (ifun == 2)
-            valE = b & a;
-        else if (ifun == 3)
-            valE = b ^ a;
-        zf = (valE == 0);
-        sf = (valE < 0);
-        if (ifun == 0)
-            of = ((a > 0 && b > 0 && valE < 0) || (a < 0 && b < 0 && valE >= 0));
-        else if (ifun == 1)
-            of = ((b > 0 && a < 0 && valE < 0) || (b < 0 && a > 0 && valE >= 0));
-        else
-            of = false;
-    }
-    else if (icode == ICode::IRMOVQ)
-        valE = valC;
-    else if (icode == ICode::RRMOVQ)
-        valE = valA;
-    else if (icode == ICode::RMMOVQ || icode == ICode::MRMOVQ)
-        valE = valB + valC;
-    else if (icode == ICode::PUSHQ || icode == ICode::CALL)
-        valE = valB - 8;
-    else if (icode == ICode::POPQ || icode == ICode::RET)
-        valE = valB + 8;
-
-    if (icode == ICode::JXX || icode == ICode::RRMOVQ)
+    case ICode::OPQ:
     {
+        // 以无符号运算回绕 (有符号溢出是未定义行为), 溢出位由符号位异或得到:
+        // 加法为两操作数同号而结果变号, 减法为两操作数异号而结果与 b 异号
+        unsigned long long a = valA, b = valB, r;
+        int of = 0;
         switch (ifun)
         {
         case 0:
-            cnd = true;
+            r = b + a;
+            of = ((a ^ r) & (b ^ r)) >> 63;
             break;
         case 1:
-            cnd = (sf ^ of) || zf;
+            r = b - a;
+            of = ((b ^ a) & (b ^ r)) >> 63;
             break;
         case 2:
-            cnd = (sf ^ of);
+            r = b & a;
             break;
         case 3:
-            cnd = zf;
-            break;
-        case 4:
-            cnd = !zf;
-            break;
-        case 5:
-            cnd = !(sf ^ of);
-            break;
-        case 6:
-            cnd = !(sf ^ of) && !zf;
+            r = b ^ a;
             break;
         default:
-            cnd = false;
+            r = valE; // 未定义的 ifun 不改变 valE
         }
+        valE = static_cast<long long>(r);
+        cc = (valE == 0) << 2 | (valE < 0) << 1 | of;
+        break;
     }
-    if (icode == ICode::HALT)
+    case ICode::IRMOVQ:
+        valE = valC;
+        break;
+    case ICode::RRMOVQ:
+        valE = valA;
+        cnd = ifun < 7 && (COND_TABLE[ifun] >> cc & 1);
+        break;
+    case ICode::JXX:
+        cnd = ifun < 7 && (COND_TABLE[ifun] >> cc & 1);
+        break;
+    case ICode::RMMOVQ:
+    case ICode::MRMOVQ:
+        valE = wrapAdd(valB, valC);
+        break;
+    case ICode::PUSHQ:
+    case ICode::CALL:
+        valE = wrapAdd(valB, -8);
+        break;
+    case ICode::POPQ:
+    case ICode::RET:
+        valE = wrapAdd(valB, 8);
+        break;
+    case ICode::HALT:
         stat = Stat::HLT;
+        break;
+    }
 }
 
 void Simulator::memory_access()
@@ -332,14 +406,15 @@ void Simulator::write_back()
         dstE = rB;
     else if (icode == ICode::PUSHQ || icode == ICode::POPQ || icode == ICode::CALL || icode == ICode::RET)
         dstE = Reg::RSP;
-    if (dstE != Reg::NONE)
-        reg[dstE] = valE;
+    reg[dstE] = valE;
 
     int dstM = Reg::NONE;
     if (icode == ICode::MRMOVQ || icode == ICode::POPQ)
         dstM = rA;
-    if (dstM != Reg::NONE)
-        reg[dstM] = valM;
+    reg[dstM] = valM;
+
+    // 写入 RNONE 槽位的结果直接丢弃, 使其始终读作 0
+    reg[Reg::NONE] = 0;
 }
 
 void Simulator::pc_update()
@@ -356,14 +431,14 @@ void Simulator::pc_update()
         PC = valP;
 }
 
-void Simulator::printJsonState(bool isFirst)
+void Simulator::printJsonState(std::ostream &out, bool isFirst)
 {
     json j;
     j["PC"] = PC;
     j["STAT"] = stat;
-    j["CC"]["ZF"] = zf ? 1 : 0;
-    j["CC"]["SF"] = sf ? 1 : 0;
-    j["CC"]["OF"] = of ? 1 : 0;
+    j["CC"]["ZF"] = cc >> 2 & 1;
+    j["CC"]["SF"] = cc >> 1 & 1;
+    j["CC"]["OF"] = cc & 1;
 
     if (gui_mode)
     {
@@ -378,30 +453,94 @@ void Simulator::printJsonState(bool isFirst)
     for (int i = 0; i < 15; ++i)
         j["REG"][rNames[i]] = reg[i];
 
-    for (int i = 0; i < MEM_SIZE; i += 8)
+    if (mem_dirty)
     {
-        long long val = 0;
-        for (int b = 0; b < 8; ++b)
-            val |= (long long)memory[i + b] << (b * 8);
-        if (val != 0)
-            j["MEM"][std::to_string(i)] = val;
+        mem_json = json();
+        for (int i = mem_lo; i < mem_hi; i += 8)
+        {
+            long long val = loadLE64(&memory[i]);
+            if (val != 0)
+                mem_json[std::to_string(i)] = val;
+        }
+        mem_dirty = false;
     }
 
+    // MEM 对象移入本条记录, 输出后再移回, 避免逐周期复制
+    bool hasMem = !mem_json.is_null();
+    if (hasMem)
+        j["MEM"] = std::move(mem_json);
+
     if (!isFirst)
-        std::cout << ",";
-    std::cout << j << std::endl;
+        out << ",";
+    out << j << '\n';
+
+    if (hasMem)
+        mem_json = std::move(j["MEM"]);
 }
 
-void Simulator::run()
+static void appendLE(std::string &buf, unsigned long long val, int bytes)
 {
-    std::cout << "[" << std::endl;
+    for (int i = 0; i < bytes; ++i)
+        buf.push_back(static_cast<char>((val >> (i * 8)) & 0xFF));
+}
+
+// 二进制记录 (小端): PC:i64, STAT/ZF/SF/OF:u8, REG:15*i64, hits:i64, misses:i64,
+// nmem:u32, 随后 nmem 组 (addr:i64, val:i64), 地址升序。
+// 内存只输出自上一条记录以来发生变化的字, val 为 0 表示该字被清零
+void Simulator::printBinaryState(std::ostream &out)
+{
+    std::string buf;
+    appendLE(buf, PC, 8);
+    buf.push_back(static_cast<char>(stat));
+    buf.push_back(static_cast<char>(cc >> 2 & 1));
+    buf.push_back(static_cast<char>(cc >> 1 & 1));
+    buf.push_back(static_cast<char>(cc & 1));
+    for (int i = 0; i < 15; ++i)
+        appendLE(buf, reg[i], 8);
+    appendLE(buf, cache_hits, 8);
+    appendLE(buf, cache_misses, 8);
+
+    std::string mem;
+    unsigned int nmem = 0;
+    for (int i = mem_lo; i < mem_hi; i += 8)
+    {
+        long long val = loadLE64(&memory[i]);
+        long long &last = emitted_mem[i / 8];
+        if (val != last)
+        {
+            appendLE(mem, i, 8);
+            appendLE(mem, val, 8);
+            nmem++;
+            last = val;
+        }
+    }
+    appendLE(buf, nmem, 4);
+    buf += mem;
+
+    out.write(buf.data(), buf.size());
+}
+
+void Simulator::printState(std::ostream &out, bool isFirst)
+{
+    if (binary_mode)
+        printBinaryState(out);
+    else
+        printJsonState(out, isFirst);
+}
+
+void Simulator::run(std::ostream &out)
+{
+    if (binary_mode)
+        out.write("Y86B", 4);
+    else
+        out << "[\n";
     bool isFirst = true;
     while (stat == Stat::AOK)
     {
         fetch();
         if (stat != Stat::AOK)
         {
-            printJsonState(isFirst);
+            printState(out, isFirst);
             break;
         }
         decode();
@@ -409,25 +548,72 @@ void Simulator::run()
         memory_access();
         write_back();
         pc_update();
-        printJsonState(isFirst);
+        printState(out, isFirst);
         isFirst = false;
-        if (PC < 0 || PC >= MEM_SIZE)
+        if (!inBounds(PC, 1))
             break;
     }
-    std::cout << "]" << std::endl;
+    if (!binary_mode)
+        out << "]\n";
+    out.flush();
+}
+
+extern "C" int y86_run(const char *src, size_t len, char **out, size_t *out_len)
+{
+    try
+    {
+        std::istringstream in(std::string(src, len));
+        std::ostringstream os;
+        Simulator sim;
+        sim.setGuiMode(true);
+        sim.setBinaryMode(true);
+        sim.loadProgram(in);
+        sim.run(os);
+
+        const std::string result = os.str();
+        char *buf = static_cast<char *>(std::malloc(result.size() ? result.size() : 1));
+        if (!buf)
+            return -1;
+        std::memcpy(buf, result.data(), result.size());
+        *out = buf;
+        *out_len = result.size();
+        return 0;
+    }
+    catch (...)
+    {
+        return -1;
+    }
 }
 
+extern "C" void y86_free(char *buf)
+{
+    std::free(buf);
+}
+
+#ifndef Y86_LIBRARY
 int main(int argc, char *argv[])
 {
+    // 输出量大 (每周期一条记录): 不与 C stdio 同步, 也不逐行刷新, 结束时统一 flush
+    std::ios::sync_with_stdio(false);
+
     Simulator sim;
 
-    if (argc > 1 && std::string(argv[1]) == "-v")
+    for (int i = 1; i < argc; ++i)
     {
-        sim.setGuiMode(true);
+        std::string arg = argv[i];
+        if (arg == "-v")
+            sim.setGuiMode(true);
+        else if (arg == "-b")
+            sim.setBinaryMode(true);
     }
 
-    sim.loadProgram();
-    sim.run();
+#ifdef _WIN32
+    _setmode(_fileno(stdout), _O_BINARY);
+#endif
+
+    sim.loadProgram(std::cin);
+    sim.run(std::cout);
 
     return 0;
-}
\ No newline at end of file
+}
+#endif
\ No newline at end of file
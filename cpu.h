@@ -5,6 +5,8 @@
 #include <array>
 #include <cstdint>
 #include <string>
+#include <iosfwd>
+#include "json.hpp"
 
 const int MEM_SIZE = 0x10000;
 
@@ -59,10 +61,11 @@ class Simulator
 {
 public:
     Simulator();
-    void loadProgram();
-    void run();
+    void loadProgram(std::istream &in);
+    void run(std::ostream &out);
     
     void setGuiMode(bool mode) { gui_mode = mode; }
+    void setBinaryMode(bool mode) { binary_mode = mode; }
 
     long long cache_hits = 0;
     long long cache_misses = 0;
@@ -71,14 +74,23 @@ private:
     long long PC = 0;
     
     std::vector<uint8_t> memory;
-    std::array<long long, 15> reg;
+    // 二进制输出时, 上一条记录中各内存字的值, 用于只输出变化量
+    std::vector<long long> emitted_mem;
+    // 曾被写入过的内存范围 [mem_lo, mem_hi), 按 8 字节对齐; 输出状态时只扫描这一段
+    int mem_lo = MEM_SIZE;
+    int mem_hi = 0;
+    // JSON 输出时上一条记录的 MEM 对象; 其后没有写内存就直接复用
+    nlohmann::json mem_json;
+    bool mem_dirty = true;
+    // 15 个寄存器外加 RNONE 槽位: 该槽位始终为 0, 读写时无需判断 RNONE
+    std::array<long long, 16> reg;
     
-    bool zf = true;
-    bool sf = false;
-    bool of = false;
+    // 条件码打包为 ZF<<2 | SF<<1 | OF, 可直接作为 COND_TABLE 的位下标
+    int cc = 4;
 
     int stat = Stat::AOK;
     bool gui_mode = false;
+    bool binary_mode = false;
 
     static const int CACHE_SETS = 16;
     static const int BLOCK_SIZE = 32;
@@ -108,11 +120,28 @@ private:
 
     long long readLong(long long addr);
     void writeLong(long long addr, long long val);
-    void printJsonState(bool isFirst);
+    void markWritten(long long addr, long long len);
+    void printState(std::ostream &out, bool isFirst);
+    void printJsonState(std::ostream &out, bool isFirst);
+    void printBinaryState(std::ostream &out);
     
+    CacheLine &accessBlock(long long addr);
     uint8_t readByteCached(long long addr);
     void writeByteCached(long long addr, uint8_t val);
     void loadBlockToCache(int set_index, unsigned long long tag);
 };
 
+// 以共享库形式构建时 (-DY86_LIBRARY) 导出的 C 接口, 供 GUI 经 ctypes 在进程内调用:
+// 输入 .yo 源码, 输出与 "cpu -v -b" 相同的二进制流, 缓冲区须用 y86_free 释放
+#ifdef _WIN32
+#define Y86_API __declspec(dllexport)
+#else
+#define Y86_API __attribute__((visibility("default")))
+#endif
+
+extern "C" {
+Y86_API int y86_run(const char *src, size_t len, char **out, size_t *out_len);
+Y86_API void y86_free(char *buf);
+}
+
 #endif
\ No newline at end of file
@@ -1,12 +1,240 @@
 import json
+import io
+import ctypes
+import itertools
 import tkinter as tk
 from tkinter import filedialog, ttk, messagebox
+import tkinter.font as tkfont
 import subprocess
+import threading
+import queue
 import platform
 import os
 import re
+import struct
+import bisect
+import sys
+import time
+from array import array
+from collections import OrderedDict
+
+# orjson 可选: 解析大段数字密集的 JSON 时明显快于标准库
+try:
+    import orjson
+    _json_loads = orjson.loads
+except ImportError:
+    _json_loads = json.loads
+
+REG_NAMES = ("rax", "rcx", "rdx", "rbx", "rsp", "rbp", "rsi", "rdi",
+             "r8", "r9", "r10", "r11", "r12", "r13", "r14")
+
+# 模拟器内存大小, 与 cpu.h 中的 MEM_SIZE 一致
+MEM_SIZE = 0x10000
+
+# cpu -b 的二进制输出格式, 见 cpu.cpp 中的 printBinaryState
+BIN_MAGIC = b"Y86B"
+_BIN_HEADER = struct.Struct("<q4B15qqqI")
+
+class Trace:
+    """按列存储的模拟轨迹: 每个字段一列, 第 i 个周期的数据位于各列的第 i 项"""
+
+    # 内存只按周期保存变化量, 每隔这么多周期保存一份完整快照
+    CHECKPOINT_INTERVAL = 256
+    # memory() 缓存的快照个数
+    MEM_CACHE_SIZE = 64
+
+    def __init__(self):
+        self.pc = array('q')
+        self.stat = bytearray()
+        self.cc = bytearray()          # ZF | SF << 1 | OF << 2
+        self.reg = array('q')          # 每周期 15 项, 顺序同 REG_NAMES
+        self.hits = array('q')
+        self.misses = array('q')
+        self.has_cache = False
+        # 第 i 周期写入的内存字为 mem_addr/mem_val[mem_ofs[i]:mem_ofs[i + 1]],
+        # 值为 0 表示该字被清零; 第 0 周期为全部非零初始内存
+        self.mem_ofs = array('q', [0])
+        self.mem_addr = array('q')
+        self.mem_val = array('q')
+        # 加载过程中的当前内存, 以及每 CHECKPOINT_INTERVAL 个周期一份的完整快照
+        self._mem_now = {}
+        self._checkpoints = []
+        # 最近按需还原过的内存快照, 键为周期号
+        self._mem_cache = OrderedDict()
+
+    def __len__(self):
+        return len(self.pc)
+
+    def append_record(self, fields, mem_blob):
+        """追加一条二进制记录: fields 为 _BIN_HEADER 解出的字段, mem_blob 为变化的地址-值对"""
+        self.pc.append(fields[0])
+        self.stat.append(fields[1])
+        self.cc.append(fields[2] | fields[3] << 1 | fields[4] << 2)
+        self.reg.extend(fields[5:20])
+        self.hits.append(fields[20])
+        self.misses.append(fields[21])
+        self.has_cache = True
+
+        pairs = array('q')
+        pairs.frombytes(mem_blob)
+        if sys.byteorder == 'big':
+            pairs.byteswap()
+        addrs, vals = pairs[0::2], pairs[1::2]
+        mem = self._mem_now
+        for addr, val in zip(addrs, vals):
+            if val:
+                mem[addr] = val
+            else:
+                mem.pop(addr, None)
+        self.mem_addr.extend(addrs)
+        self.mem_val.extend(vals)
+        self._end_cycle()
+
+    def append_state(self, state):
+        """追加一个 JSON 状态字典"""
+        cc = state['CC']
+        self.pc.append(state['PC'])
+        self.stat.append(state['STAT'])
+        self.cc.append(cc['ZF'] | cc['SF'] << 1 | cc['OF'] << 2)
+        reg_data = state['REG']
+        self.reg.extend(reg_data[rname] for rname in REG_NAMES)
+        if 'CACHE' in state:
+            self.hits.append(state['CACHE']['hits'])
+            self.misses.append(state['CACHE']['misses'])
+            self.has_cache = True
+
+        # JSON 给出完整的非零内存, 与上一周期比较后只保存变化量
+        prev = self._mem_now
+        mem = {int(k): v for k, v in state['MEM'].items()}
+        delta = [(addr, val) for addr, val in mem.items() if prev.get(addr) != val]
+        delta.extend((addr, 0) for addr in prev if addr not in mem)
+        for addr, val in sorted(delta):
+            self.mem_addr.append(addr)
+            self.mem_val.append(val)
+        self._mem_now = mem
+        self._end_cycle()
+
+    def _end_cycle(self):
+        self.mem_ofs.append(len(self.mem_addr))
+        if (len(self.mem_ofs) - 2) % self.CHECKPOINT_INTERVAL == 0:
+            self._checkpoints.append(dict(self._mem_now))
+
+    def regs(self, i):
+        return self.reg[i * 15:(i + 1) * 15]
+
+    def reg_hex(self, i):
+        """第 i 周期 15 个寄存器的 16 位十六进制串, 一次 bytes.hex() 完成编码"""
+        regs = self.regs(i)
+        if sys.byteorder == 'little':
+            regs.byteswap()
+        text = regs.tobytes().hex()
+        return ["0x" + text[k:k + 16] for k in range(0, 240, 16)]
+
+    def changed_regs(self, i):
+        """第 i 周期相对上一周期取值改变的寄存器下标"""
+        if i == 0:
+            return frozenset()
+        cur, prev = self.regs(i), self.regs(i - 1)
+        if cur == prev:
+            return frozenset()
+        return frozenset(k for k in range(15) if cur[k] != prev[k])
+
+    def memory(self, i):
+        """第 i 周期的非零内存 {地址: 值}, 由最近的快照加变化量按需还原; 返回值不可修改"""
+        cache = self._mem_cache
+        mem = cache.get(i)
+        if mem is not None:
+            cache.move_to_end(i)
+            return mem
+        # 单步前进时上一周期通常已在缓存中
+        prev = cache.get(i - 1)
+        if prev is not None:
+            mem, start = dict(prev), i
+        else:
+            k = i // self.CHECKPOINT_INTERVAL
+            mem, start = dict(self._checkpoints[k]), k * self.CHECKPOINT_INTERVAL + 1
+        lo, hi = self.mem_ofs[start], self.mem_ofs[i + 1]
+        for addr, val in zip(self.mem_addr[lo:hi], self.mem_val[lo:hi]):
+            if val:
+                mem[addr] = val
+            else:
+                mem.pop(addr, None)
+        cache[i] = mem
+        if len(cache) > self.MEM_CACHE_SIZE:
+            cache.popitem(last=False)
+        return mem
+
+    def written(self, i):
+        """第 i 周期写入 (含清零) 的全部地址"""
+        return self.mem_addr[self.mem_ofs[i]:self.mem_ofs[i + 1]]
+
+    def changed_memory(self, i):
+        """第 i 周期相对上一周期新出现或取值改变的地址"""
+        if i == 0:
+            return frozenset()
+        lo, hi = self.mem_ofs[i], self.mem_ofs[i + 1]
+        return frozenset(addr for addr, val in zip(self.mem_addr[lo:hi], self.mem_val[lo:hi]) if val)
+
+# 以共享库形式构建的模拟器 (见 README), 存在时在进程内调用, 免去子进程与管道
+NATIVE_LIB_NAMES = {"Windows": "cpu.dll", "Darwin": "libcpu.dylib"}
+
+def load_native_simulator():
+    """加载当前目录下的模拟器共享库, 不存在或无法加载时返回 None"""
+    path = os.path.abspath(NATIVE_LIB_NAMES.get(platform.system(), "libcpu.so"))
+    if not os.path.exists(path):
+        return None
+    try:
+        lib = ctypes.CDLL(path)
+    except OSError:
+        return None
+    lib.y86_run.argtypes = [ctypes.c_char_p, ctypes.c_size_t,
+                            ctypes.POINTER(ctypes.c_void_p), ctypes.POINTER(ctypes.c_size_t)]
+    lib.y86_run.restype = ctypes.c_int
+    lib.y86_free.argtypes = [ctypes.c_void_p]
+    lib.y86_free.restype = None
+    return lib
+
+def run_native_simulator(lib, source):
+    """在进程内运行模拟器, 返回与 "cpu -v -b" 相同的二进制输出"""
+    buf, size = ctypes.c_void_p(), ctypes.c_size_t()
+    if lib.y86_run(source, len(source), ctypes.byref(buf), ctypes.byref(size)) != 0:
+        raise RuntimeError("Simulator library failed.")
+    try:
+        return ctypes.string_at(buf, size.value)
+    finally:
+        lib.y86_free(buf)
+
+def read_binary_states(stream, trace):
+    """逐条解码二进制周期记录并追加到 trace, 每追加一个周期产出一次当前周期数"""
+    while True:
+        header = stream.read(_BIN_HEADER.size)
+        if len(header) < _BIN_HEADER.size:
+            return
+        fields = _BIN_HEADER.unpack(header)
+        trace.append_record(fields, stream.read(fields[22] * 16))
+        yield len(trace)
+
+def read_json_states(stream, trace, head=b""):
+    """旧版文本输出: 每行一个 JSON 对象 (可能带前导逗号), 外加首尾的方括号行"""
+    for line in itertools.chain(head.splitlines(), stream):
+        line = line.strip().lstrip(b',')
+        if line.startswith(b'{'):
+            trace.append_state(_json_loads(line))
+            yield len(trace)
 
 class ModernY86Visualizer:
+    # 加载时每解析多少个周期刷新一次进度
+    PROGRESS_INTERVAL = 1000
+    # 后台加载时轮询结果队列的间隔 (毫秒)
+    POLL_INTERVAL_MS = 50
+    # 两次单步刷新之间的最短间隔 (毫秒), 约一帧
+    FRAME_INTERVAL_MS = 16
+    STAT_NAMES = {1: "AOK", 2: "HLT", 3: "ADR", 4: "INS"}
+    # .yo 行首的指令地址, 如 "0x00a: 30f0..."
+    _ADDR_RE = re.compile(r'^[ \t]*(0x[0-9a-fA-F]+):', re.MULTILINE)
+    # 源码注释: 均不跨行, 与 Tk 文本检索的逐行匹配一致
+    _COMMENT_RES = (re.compile(r'#.*'), re.compile(r'/\*.*?\*/'))
+
     def __init__(self, root):
         self.root = root
         self.root.title("Y86-64 Simulator")
@@ -35,10 +263,15 @@ class ModernY86Visualizer:
             pass
         
         # --- 字体配置 ---
+        # 未安装首选字体时直接改用 Tk 内置字族, 免得每次用到该字体都走 Tk 的替换查找
+        installed = set(tkfont.families(self.root))
         # 1. 代码/数据字体 (硬核风格)
-        self.font_code = "Maple Mono"
+        self.font_code = "Maple Mono" if "Maple Mono" in installed else "Courier"
         # 2. 界面字体 (人文风格)
-        self.font_ui = "LXGW Wenkai Mono"
+        self.font_ui = "LXGW Wenkai Mono" if "LXGW Wenkai Mono" in installed else "Helvetica"
+        # 3. 寄存器数值字体: 预先创建具名字体, 切换高亮时直接复用, 免去 Tk 反复解析字体描述
+        self.font_reg = tkfont.Font(root=self.root, family=self.font_code, size=18)
+        self.font_reg_bold = tkfont.Font(root=self.root, family=self.font_code, size=18, weight="bold")
         
         # --- 配色方案 (Light Theme) ---
         self.colors = {
@@ -65,10 +298,30 @@ class ModernY86Visualizer:
         self.configure_styles()
         self.root.configure(bg=self.colors["bg"])
 
-        self.states = []
+        self.trace = Trace()
         self.current_step = 0
+        # 尚未刷新的目标周期 (见 _request_step)
+        self._pending_step = None
+        self._last_render = 0.0
+        # 每个周期格式化好的显示字符串, 首次显示时生成
+        self._render_cache = []
         self.reg_widgets = {} 
-        self.pc_to_line = {} 
+        self._highlighted_regs = frozenset()
+        # 各控件当前显示的寄存器文本与 STAT 颜色, 用于跳过无变化的 configure
+        self._reg_text = ["0x0000000000000000"] * len(REG_NAMES)
+        self._stat_color = None
+        self.pc_to_line = array('I')
+        self._source = None
+        self._highlighted_line = 0
+
+        # 内存表当前显示的内容: 地址 -> 值, 以及升序地址列表 (与表格行序一致)
+        self._mem_shown = {}
+        # 内存表当前对应的周期, None 表示需要与整份内存比较
+        self._mem_step = None
+        self._label_text = {}
+        self._mem_addrs = []
+        # 当前以高亮显示的内存地址
+        self._highlighted_mem = frozenset()
         
         self.setup_ui()
 
@@ -230,6 +483,8 @@ class ModernY86Visualizer:
         self.mem_tree.column("addr", width=180, anchor="center")
         self.mem_tree.column("val", width=300, anchor="center")
         
+        self.mem_tree.tag_configure("changed", foreground=self.colors["highlight"])
+        
         mem_scroll = ttk.Scrollbar(mem_frame, orient="vertical", command=self.mem_tree.yview)
         self.mem_tree.configure(yscrollcommand=mem_scroll.set)
         
@@ -245,25 +500,24 @@ class ModernY86Visualizer:
         content.pack(fill=tk.X)
         
         # PC
-        self.var_pc = tk.StringVar(value="0x0")
         pc_frame = ttk.Frame(content, style="Panel.TFrame")
         pc_frame.pack(side=tk.LEFT, padx=(0, 25))
         ttk.Label(pc_frame, text="PC", foreground="#666666", background=self.colors["panel_bg"]).pack(anchor="w")
-        ttk.Label(pc_frame, textvariable=self.var_pc, style="Status.TLabel", foreground=self.colors["accent"]).pack(anchor="w")
+        self.lbl_pc = ttk.Label(pc_frame, text="0x0", style="Status.TLabel", foreground=self.colors["accent"])
+        self.lbl_pc.pack(anchor="w")
         
         # CC
-        self.var_cc = tk.StringVar(value="ZF=1 SF=0 OF=0")
         cc_frame = ttk.Frame(content, style="Panel.TFrame")
         cc_frame.pack(side=tk.LEFT, padx=(0, 25))
         ttk.Label(cc_frame, text="Flags", foreground="#666666", background=self.colors["panel_bg"]).pack(anchor="w")
-        ttk.Label(cc_frame, textvariable=self.var_cc, style="Status.TLabel", foreground=self.colors["fg"]).pack(anchor="w")
+        self.lbl_cc = ttk.Label(cc_frame, text="ZF=1 SF=0 OF=0", style="Status.TLabel", foreground=self.colors["fg"])
+        self.lbl_cc.pack(anchor="w")
 
         # STAT
-        self.var_stat = tk.StringVar(value="AOK")
         stat_frame = ttk.Frame(content, style="Panel.TFrame")
         stat_frame.pack(side=tk.LEFT)
         ttk.Label(stat_frame, text="Stat", foreground="#666666", background=self.colors["panel_bg"]).pack(anchor="w")
-        self.lbl_stat = ttk.Label(stat_frame, textvariable=self.var_stat, style="Status.TLabel")
+        self.lbl_stat = ttk.Label(stat_frame, text="AOK", style="Status.TLabel")
         self.lbl_stat.pack(anchor="w")
 
     def create_cache_card(self, parent):
@@ -274,23 +528,23 @@ class ModernY86Visualizer:
         content = ttk.Frame(card, style="Panel.TFrame")
         content.pack(fill=tk.X)
 
-        self.var_hits = tk.StringVar(value="0")
         f1 = ttk.Frame(content, style="Panel.TFrame")
         f1.pack(side=tk.LEFT, padx=(0, 25))
         ttk.Label(f1, text="Hits", foreground="#666666", background=self.colors["panel_bg"]).pack(anchor="w")
-        ttk.Label(f1, textvariable=self.var_hits, style="Value.TLabel").pack(anchor="w")
+        self.lbl_hits = ttk.Label(f1, text="0", style="Value.TLabel")
+        self.lbl_hits.pack(anchor="w")
 
-        self.var_miss = tk.StringVar(value="0")
         f2 = ttk.Frame(content, style="Panel.TFrame")
         f2.pack(side=tk.LEFT, padx=(0, 25))
         ttk.Label(f2, text="Misses", foreground="#666666", background=self.colors["panel_bg"]).pack(anchor="w")
-        ttk.Label(f2, textvariable=self.var_miss, style="Value.TLabel").pack(anchor="w")
+        self.lbl_miss = ttk.Label(f2, text="0", style="Value.TLabel")
+        self.lbl_miss.pack(anchor="w")
 
-        self.var_rate = tk.StringVar(value="0.0%")
         f3 = ttk.Frame(content, style="Panel.TFrame")
         f3.pack(side=tk.LEFT)
         ttk.Label(f3, text="Rate", foreground="#666666", background=self.colors["panel_bg"]).pack(anchor="w")
-        ttk.Label(f3, textvariable=self.var_rate, style="Cache.TLabel").pack(anchor="w")
+        self.lbl_rate = ttk.Label(f3, text="0.0%", style="Cache.TLabel")
+        self.lbl_rate.pack(anchor="w")
 
     def create_register_card(self, parent):
         card = ttk.Frame(parent, style="Panel.TFrame", padding=25)
@@ -300,20 +554,16 @@ class ModernY86Visualizer:
         grid_frame = ttk.Frame(card, style="Panel.TFrame")
         grid_frame.pack(fill=tk.BOTH, expand=True)
         
-        regs = ["rax", "rcx", "rdx", "rbx", "rsp", "rbp", "rsi", "rdi", 
-                "r8", "r9", "r10", "r11", "r12", "r13", "r14"]
-        
-        for i in range(len(regs)):
+        for i in range(len(REG_NAMES)):
             grid_frame.rowconfigure(i, weight=1)
 
-        for i, rname in enumerate(regs):
+        for i, rname in enumerate(REG_NAMES):
             row = i
             lbl_name = ttk.Label(grid_frame, text=f"%{rname}", width=5, 
-                               background=self.colors["panel_bg"], foreground="#666666", font=(self.font_code, 18))
+                               background=self.colors["panel_bg"], foreground="#666666", font=self.font_reg)
             lbl_name.grid(row=row, column=0, sticky="w", pady=3)
             
-            lbl_val = ttk.Label(grid_frame, text="0x0000000000000000", style="Value.TLabel")
-            lbl_val.configure(font=(self.font_code, 18))
+            lbl_val = ttk.Label(grid_frame, text="0x0000000000000000", style="Value.TLabel", font=self.font_reg)
             lbl_val.grid(row=row, column=1, sticky="e", padx=(20, 0), pady=3)
             
             self.reg_widgets[rname] = lbl_val
@@ -332,148 +582,342 @@ class ModernY86Visualizer:
         try:
             with open(filename, 'r', encoding='utf-8', errors='ignore') as f:
                 input_data = f.read()
-            
-            result = subprocess.run([bin_path, '-v'], input=input_data, text=True, capture_output=True, encoding='utf-8')
-            
-            if result.returncode != 0 and not result.stdout:
-                raise Exception(f"Simulator crashed.\n{result.stderr}")
+        except Exception as e:
+            messagebox.showerror("Error", str(e))
+            return
+
+        # 模拟器在后台线程中运行并解码, 主循环定时轮询结果, 界面保持响应
+        for btn in (self.btn_load, self.btn_prev, self.btn_next):
+            btn.config(state=tk.DISABLED)
+        self.lbl_progress.config(text="Loading...")
+        self._load_queue = queue.Queue()
+        native = load_native_simulator()
+        if native is not None:
+            target, args = self._load_native_worker, (native, input_data, self._load_queue)
+        else:
+            target, args = self._load_worker, (bin_path, input_data, self._load_queue)
+        self._loader_thread = threading.Thread(target=target, args=args, daemon=True)
+        self._loader_thread.start()
+        self.root.after(self.POLL_INTERVAL_MS, self._poll_loader, filename, input_data)
+
+    def _load_worker(self, bin_path, input_data, result_queue):
+        # 运行于后台线程, 不得直接操作 Tk 控件
+        try:
+            # with 退出时关闭全部管道并回收子进程, 解码出错时也不会遗留僵尸进程
+            with subprocess.Popen([bin_path, '-v', '-b'], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                  stderr=subprocess.PIPE, bufsize=1 << 20) as proc:
+                try:
+                    # 模拟器先读完全部输入再开始输出, 因此可以一次写完 stdin
+                    proc.stdin.write(input_data.encode('utf-8'))
+                    proc.stdin.close()
+
+                    # 优先读取二进制记录; 不认识 -b 的旧版模拟器仍输出逐行 JSON
+                    trace = Trace()
+                    head = proc.stdout.read(len(BIN_MAGIC))
+                    if head == BIN_MAGIC:
+                        reader = read_binary_states(proc.stdout, trace)
+                    else:
+                        reader = read_json_states(proc.stdout, trace, head + proc.stdout.readline())
+
+                    for count in reader:
+                        if count % self.PROGRESS_INTERVAL == 0:
+                            result_queue.put(('progress', count))
+                    stderr = proc.stderr.read().decode('utf-8', errors='ignore')
+                    proc.wait()
+                except BaseException:
+                    # 中途出错时子进程可能仍阻塞在写管道上, 先结束它, 否则 with 的 wait 会一直等待
+                    proc.kill()
+                    raise
 
-            raw_output = result.stdout
-            start = raw_output.find('[')
-            end = raw_output.rfind(']') + 1
-            if start == -1 or end == 0:
+            if proc.returncode != 0 and not len(trace):
+                raise Exception(f"Simulator crashed.\n{stderr}")
+            if not len(trace):
                 raise ValueError("No JSON output found.")
-            self.states = json.loads(raw_output[start:end])
-            
+            result_queue.put(('done', trace))
+        except Exception as e:
+            result_queue.put(('error', e))
+
+    def _load_native_worker(self, lib, input_data, result_queue):
+        # 同 _load_worker, 但通过共享库在进程内运行模拟器 (ctypes 调用期间释放 GIL)
+        try:
+            stream = io.BytesIO(run_native_simulator(lib, input_data.encode('utf-8')))
+            if stream.read(len(BIN_MAGIC)) != BIN_MAGIC:
+                raise ValueError("Unexpected simulator output.")
+            trace = Trace()
+            for count in read_binary_states(stream, trace):
+                if count % self.PROGRESS_INTERVAL == 0:
+                    result_queue.put(('progress', count))
+            if not len(trace):
+                raise ValueError("No simulator output found.")
+            result_queue.put(('done', trace))
+        except Exception as e:
+            result_queue.put(('error', e))
+
+    def _poll_loader(self, filename, input_data):
+        try:
+            while True:
+                kind, payload = self._load_queue.get_nowait()
+                if kind == 'progress':
+                    self.lbl_progress.config(text=f"Loading: {payload} cycles")
+                elif kind == 'done':
+                    self._finish_load(payload, filename, input_data)
+                    return
+                else:
+                    self._restore_buttons()
+                    messagebox.showerror("Error", str(payload))
+                    return
+        except queue.Empty:
+            pass
+        self.root.after(self.POLL_INTERVAL_MS, self._poll_loader, filename, input_data)
+
+    def _finish_load(self, trace, filename, input_data):
+        try:
+            self.trace = trace
+            self._pending_step = None
+            self._render_cache = [None] * len(trace)
+            self.reset_memory_view()
+
             self.parse_source_code(input_data)
             
             self.current_step = 0
             self.update_display()
+            self.btn_load.config(state=tk.NORMAL)
             self.btn_next.config(state=tk.NORMAL)
             self.btn_prev.config(state=tk.DISABLED)
             self.lbl_progress.config(text=f"Loaded: {os.path.basename(filename)}")
             
         except Exception as e:
+            self._restore_buttons()
             messagebox.showerror("Error", str(e))
 
+    def _restore_buttons(self):
+        self.btn_load.config(state=tk.NORMAL)
+        self._update_nav_buttons()
+
     def parse_source_code(self, source_content):
-        self.pc_to_line = {}
-        lines = source_content.splitlines()
-        
+        # 重新加载同一份源码时文本、注释高亮和 pc_to_line 都不变, 无需重新插入
+        if source_content == self._source:
+            return
+        self._source = source_content
+        self._highlighted_line = 0
+
         self.src_text.config(state=tk.NORMAL)
         self.src_text.delete(1.0, tk.END)
         self.src_text.insert(tk.END, source_content)
         
-        # [核心逻辑] 注释高亮
-        count_var = tk.IntVar()
-        
-        # 1. 高亮井号注释 (# ...)
-        start_idx = "1.0"
-        while True:
-            # 查找 #
-            idx = self.src_text.search(r"#.*", start_idx, stopindex=tk.END, regexp=True, count=count_var)
-            if not idx:
-                break
-            # 计算结束位置
-            end_idx = f"{idx}+{count_var.get()}c"
-            self.src_text.tag_add("comment", idx, end_idx)
-            start_idx = end_idx
-            
-        # 2. 高亮 C 风格注释 (/* ... */)
-        start_idx = "1.0"
-        while True:
-            idx = self.src_text.search(r"/\*.*?\*/", start_idx, stopindex=tk.END, regexp=True, count=count_var)
-            if not idx:
-                break
-            end_idx = f"{idx}+{count_var.get()}c"
-            self.src_text.tag_add("comment", idx, end_idx)
-            start_idx = end_idx
+        # [核心逻辑] 注释高亮: 用预编译正则在 Python 端扫描整段源码,
+        # 所有区间合并为一次 tag_add, 不再每找到一处注释就调用一次 Tk 的 search
+        line_starts = [0]
+        line_starts.extend(m.end() for m in re.finditer('\n', source_content))
+
+        def text_index(offset):
+            line = bisect.bisect_right(line_starts, offset)
+            return f"{line}.{offset - line_starts[line - 1]}"
+
+        ranges = []
+        # 1. 井号注释 (# ...)  2. C 风格注释 (/* ... */)
+        for pattern in self._COMMENT_RES:
+            for match in pattern.finditer(source_content):
+                ranges.append(text_index(match.start()))
+                ranges.append(text_index(match.end()))
+        if ranges:
+            self.src_text.tag_add("comment", *ranges)
 
         self.src_text.config(state=tk.DISABLED)
         
-        for i, line in enumerate(lines):
-            match = re.match(r'\s*(0x[0-9a-fA-F]+):', line)
-            if match:
-                try:
-                    address = int(match.group(1), 16)
-                    if address not in self.pc_to_line: self.pc_to_line[address] = i + 1
-                except ValueError: pass
+        # 整段源码一次扫描, 行号由上一个匹配处累加换行数得到
+        line_of = {}
+        line_no, pos = 1, 0
+        for match in self._ADDR_RE.finditer(source_content):
+            line_no += source_content.count('\n', pos, match.start())
+            pos = match.start()
+            # 正则已保证是合法的十六进制, 无需 try/except;
+            # 超出内存的地址不会被装载, PC 也到不了, 忽略以免按其大小分配数组
+            address = int(match.group(1), 16)
+            if address < MEM_SIZE:
+                line_of.setdefault(address, line_no)
+
+        # 指令地址小而稠密, 用按 PC 下标的数组代替字典, 0 表示无对应行
+        self.pc_to_line = array('I', bytes(4 * (max(line_of) + 1))) if line_of else array('I')
+        for address, line in line_of.items():
+            self.pc_to_line[address] = line
 
     def next_step(self):
-        if self.current_step < len(self.states) - 1:
-            self.current_step += 1
-            self.update_display()
-            self.btn_prev.config(state=tk.NORMAL)
-            if self.current_step == len(self.states) - 1: self.btn_next.config(state=tk.DISABLED)
+        self._request_step(1)
 
     def prev_step(self):
-        if self.current_step > 0:
-            self.current_step -= 1
-            self.update_display()
-            self.btn_next.config(state=tk.NORMAL)
-            if self.current_step == 0: self.btn_prev.config(state=tk.DISABLED)
+        self._request_step(-1)
+
+    def _request_step(self, delta):
+        # 连续点击只累加目标周期, 在 Tk 空闲时统一刷新一次;
+        # 距上次刷新不足一帧时推迟到下一帧, 按住按钮时不会逐周期重绘
+        base = self.current_step if self._pending_step is None else self._pending_step
+        target = max(0, min(len(self.trace) - 1, base + delta))
+        if self._pending_step is None:
+            wait = self.FRAME_INTERVAL_MS - int((time.monotonic() - self._last_render) * 1000)
+            if wait > 0:
+                self.root.after(wait, self._flush_step)
+            else:
+                self.root.after_idle(self._flush_step)
+        self._pending_step = target
+
+    def _flush_step(self):
+        step, self._pending_step = self._pending_step, None
+        if step is None or step == self.current_step:
+            return
+        self.current_step = step
+        self.update_display()
+        self._update_nav_buttons()
+        self._last_render = time.monotonic()
+
+    def _update_nav_buttons(self):
+        self.btn_prev.config(state=tk.NORMAL if self.current_step > 0 else tk.DISABLED)
+        self.btn_next.config(state=tk.NORMAL if self.current_step < len(self.trace) - 1 else tk.DISABLED)
+
+    def render_step(self, step):
+        frame = self._render_cache[step]
+        if frame is not None:
+            return frame
+
+        trace = self.trace
+        cc = trace.cc[step]
+        stat = trace.stat[step]
+        frame = {
+            'pc': f"0x{trace.pc[step]:x}",
+            'cc': f"ZF={cc & 1} SF={cc >> 1 & 1} OF={cc >> 2}",
+            'stat': self.STAT_NAMES.get(stat, str(stat)),
+            'reg': trace.reg_hex(step),
+            'changed_regs': trace.changed_regs(step),
+            'changed_mem': trace.changed_memory(step),
+        }
+        if trace.has_cache:
+            hits, misses = trace.hits[step], trace.misses[step]
+            total = hits + misses
+            rate = hits / total * 100.0 if total > 0 else 0.0
+            frame['cache'] = (str(hits), str(misses), f"{rate:.1f}%")
+        self._render_cache[step] = frame
+        return frame
 
     def update_display(self):
-        state = self.states[self.current_step]
-        prev_state = self.states[self.current_step - 1] if self.current_step > 0 else None
-        
-        self.lbl_progress.config(text=f"Cycle: {self.current_step + 1} / {len(self.states)}")
-        
-        current_pc = state['PC']
-        self.var_pc.set(f"0x{current_pc:x}")
-        
-        cc = state['CC']
-        self.var_cc.set(f"ZF={cc['ZF']} SF={cc['SF']} OF={cc['OF']}")
-        
-        stat_map = {1: "AOK", 2: "HLT", 3: "ADR", 4: "INS"}
-        stat_val = stat_map.get(state['STAT'], str(state['STAT']))
-        self.var_stat.set(stat_val)
-        
-        if state['STAT'] != 1:
-            self.lbl_stat.configure(foreground=self.colors["stat_err"])
-        else:
-            self.lbl_stat.configure(foreground=self.colors["stat_ok"])
+        step = self.current_step
+        frame = self.render_step(step)
 
-        if 'CACHE' in state:
-            c = state['CACHE']
-            self.var_hits.set(str(c['hits']))
-            self.var_miss.set(str(c['misses']))
-            self.var_rate.set(f"{c['rate']:.1f}%")
+        self.lbl_progress.config(text=f"Cycle: {step + 1} / {len(self.trace)}")
 
-        self.src_text.tag_remove("current_line", "1.0", tk.END)
-        line_num = self.pc_to_line.get(state['PC'])
-        if line_num:
-            self.src_text.tag_add("current_line", f"{line_num}.0", f"{line_num+1}.0")
-            self.src_text.see(f"{line_num}.0")
+        self._set_label(self.lbl_pc, frame['pc'])
+        self._set_label(self.lbl_cc, frame['cc'])
+        self._set_label(self.lbl_stat, frame['stat'])
 
-        reg_data = state['REG']
-        prev_reg = prev_state['REG'] if prev_state else None
-        
-        for rname, val in reg_data.items():
-            widget = self.reg_widgets.get(rname)
-            if widget:
-                unsigned_val = val & 0xFFFFFFFFFFFFFFFF
-                hex_val = f"0x{unsigned_val:016x}"
-                widget.config(text=hex_val)
-                if prev_reg and prev_reg.get(rname) != val:
-                    widget.configure(foreground=self.colors["highlight"], font=(self.font_code, 18, "bold"))
-                else:
-                    widget.configure(foreground=self.colors["mem_fg"], font=(self.font_code, 18))
+        stat_color = self.colors["stat_ok"] if self.trace.stat[step] == 1 else self.colors["stat_err"]
+        if stat_color != self._stat_color:
+            self.lbl_stat.configure(foreground=stat_color)
+            self._stat_color = stat_color
 
-        for item in self.mem_tree.get_children():
-            self.mem_tree.delete(item)
-        mem_data = state['MEM']
-        sorted_addr = sorted([int(k) for k in mem_data.keys()])
-        for addr in sorted_addr:
-            val = mem_data[str(addr)]
-            unsigned_val = val & 0xFFFFFFFFFFFFFFFF
-            self.mem_tree.insert("", "end", values=(f"0x{addr:04x}", f"0x{unsigned_val:016x}"))
+        if 'cache' in frame:
+            hits, misses, rate = frame['cache']
+            self._set_label(self.lbl_hits, hits)
+            self._set_label(self.lbl_miss, misses)
+            self._set_label(self.lbl_rate, rate)
+
+        # 只移除上一次高亮的那一行, 不必扫描整段文本
+        pc = self.trace.pc[step]
+        line_num = self.pc_to_line[pc] if 0 <= pc < len(self.pc_to_line) else 0
+        if line_num != self._highlighted_line:
+            old_line = self._highlighted_line
+            if old_line:
+                self.src_text.tag_remove("current_line", f"{old_line}.0", f"{old_line+1}.0")
+            if line_num:
+                self.src_text.tag_add("current_line", f"{line_num}.0", f"{line_num+1}.0")
+                self.src_text.see(f"{line_num}.0")
+            self._highlighted_line = line_num
+
+        # 只更新显示内容确有变化的寄存器, 避免无效的 Tcl 调用
+        shown = self._reg_text
+        for i, hex_val in enumerate(frame['reg']):
+            if shown[i] != hex_val:
+                self.reg_widgets[REG_NAMES[i]].config(text=hex_val)
+                shown[i] = hex_val
+
+        # 只重设高亮状态发生翻转的寄存器 (通常每步 0~2 个)
+        changed_regs = frame['changed_regs']
+        for i in self._highlighted_regs - changed_regs:
+            self.reg_widgets[REG_NAMES[i]].configure(foreground=self.colors["mem_fg"], font=self.font_reg)
+        for i in changed_regs - self._highlighted_regs:
+            self.reg_widgets[REG_NAMES[i]].configure(foreground=self.colors["highlight"], font=self.font_reg_bold)
+        self._highlighted_regs = changed_regs
+
+        # 相邻两周期的内存只在较晚周期写入的地址上可能不同, 只需比较这些地址
+        touched = None
+        if self._mem_step is not None and abs(step - self._mem_step) <= 1:
+            touched = self.trace.written(max(step, self._mem_step)) if step != self._mem_step else ()
+        self.update_memory_view(self.trace.memory(step), frame['changed_mem'], touched)
+        self._mem_step = step
+
+    def _set_label(self, label, text):
+        # 文本未变时不发出 Tcl 调用
+        if self._label_text.get(label) != text:
+            label.config(text=text)
+            self._label_text[label] = text
+
+    def reset_memory_view(self):
+        self.mem_tree.delete(*self.mem_tree.get_children())
+        self._mem_shown.clear()
+        self._mem_addrs.clear()
+        self._highlighted_mem = frozenset()
+        self._mem_step = None
+
+    def update_memory_view(self, mem_data, changed, touched=None):
+        # 只与表格当前内容做差量更新, 而不是每步清空后全部重建
+        # touched 为可能与表格内容不同的地址, None 表示逐项比较整份 mem_data
+        # 行 iid 固定为 "m<地址>", 便于在 Tcl 脚本中直接引用
+        tree = self.mem_tree
+        shown = self._mem_shown
+        if touched is None:
+            gone = [a for a in shown if a not in mem_data]
+            candidates = mem_data
+        else:
+            gone = [a for a in touched if a in shown and a not in mem_data]
+            candidates = [a for a in touched if a in mem_data]
+        # 删除、改值、插入和高亮切换拼成一段 Tcl 脚本, 一次 eval 完成
+        # (加载后首次显示时可能有上千行)
+        script = []
+        if gone:
+            for addr in gone:
+                del shown[addr]
+                del self._mem_addrs[bisect.bisect_left(self._mem_addrs, addr)]
+            script.append(f"{tree} delete {{{' '.join(f'm{addr}' for addr in gone)}}}")
+
+        for addr in candidates:
+            val = mem_data[addr]
+            old = shown.get(addr)
+            if old == val:
+                continue
+            addr_hex = f"0x{addr:04x}"
+            val_hex = f"0x{val & 0xFFFFFFFFFFFFFFFF:016x}"
+            if old is None:
+                pos = bisect.bisect_left(self._mem_addrs, addr)
+                self._mem_addrs.insert(pos, addr)
+                script.append(f"{tree} insert {{}} {pos} -id m{addr} -values {{{addr_hex} {val_hex}}}")
+            else:
+                script.append(f"{tree} item m{addr} -values {{{addr_hex} {val_hex}}}")
+            shown[addr] = val
+
+        # 高亮本周期写入的内存字, 同样只改动状态翻转的行
+        for addr in self._highlighted_mem - changed:
+            if addr in shown:
+                script.append(f"{tree} item m{addr} -tags {{}}")
+        for addr in changed - self._highlighted_mem:
+            script.append(f"{tree} item m{addr} -tags changed")
+        if script:
+            tree.tk.eval("\n".join(script))
+        self._highlighted_mem = changed
 
 if __name__ == "__main__":
-    root = tk.Tk()
+    # DPI 感知须在创建 Tk 窗口之前设置才会生效
     try:
         from ctypes import windll
         windll.shcore.SetProcessDpiAwareness(1)
     except: pass
+    root = tk.Tk()
     app = ModernY86Visualizer(root)
     root.mainloop()
\ No newline at end of file